@@ -4,45 +4,176 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 from oauth2client.service_account import ServiceAccountCredentials
-from fpdf import FPDF
-import os, uuid, tempfile
+import io
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-import time
-import json
+from googleapiclient.http import MediaIoBaseUpload, build_http
 import gspread
+from gspread.utils import fill_gaps, rowcol_to_a1
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
 import traceback
-import hashlib
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
 
 # --- 🔒 Hash-basierte Speicherlogik & Logging Setup ---
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
-def get_data_hash(data):
+def get_data_hash(rows):
     """
-    Erzeugt einen konsistenten Hash für verschachtelte Datenstrukturen (z.B. Listen von Listen).
-    Nutzt JSON-Serialisierung mit Sortierung der Schlüssel und SHA256-Hash.
+    Erzeugt einen Fingerprint für Tabellenzeilen (Liste von Listen) zur reinen Änderungserkennung.
+    Nutzt Pythons eingebautes hash() über Tupel – ohne Serialisierung. Der Wert ist nur innerhalb
+    des Prozesses stabil, was für den Vergleich in st.session_state genügt.
     """
-    data_str = json.dumps(data, sort_keys=True, separators=(',', ':'))
-    return hashlib.sha256(data_str.encode('utf-8')).hexdigest()
+    return hash(tuple(map(tuple, rows)))
+
+# Alle geänderten Sheets eines Runs werden gesammelt und am Ende gemeinsam geschrieben
+pending_updates = []
+SHEET_LABELS = ["Options", "Criteria", "Comments", "Overview", "Full Scores"]
+
+def mark_dirty(*labels):
+    """on_change-Callback: markiert die betroffenen Sheet-Abschnitte als geändert (wird nach dem Speichern gelöscht)."""
+    for label in labels:
+        st.session_state[f"{label}_dirty"] = True
+
+def is_dirty(label):
+    return st.session_state.get(f"{label}_dirty", False)
 
-def safe_update(ws, new_rows, label):
-    """Speichert Daten nur, wenn sie sich gegenüber dem letzten Hash geändert haben."""
+def request_save():
+    st.session_state["_save_requested"] = True
+
+def submit_evaluation():
+    """on_click des Formular-Buttons: Widgets in st.form haben kein on_change – Gewichte/Bewertungen markieren und speichern."""
+    mark_dirty("Criteria", "Overview", "Full Scores")
+    request_save()
+
+def safe_update(ws, new_rows, label, cells=None):
+    """
+    Merkt Daten zum Speichern vor, wenn sie sich gegenüber dem letzten Hash geändert haben.
+    cells=None → ganzes Sheet neu schreiben; sonst nur die angegebenen Zellen [(A1, Wert), ...].
+    """
     key = f"{label}_hash"
     new_hash = get_data_hash(new_rows)
 
     if st.session_state.get(key) != new_hash:
-        try:
-            ws.update("A1", new_rows)
-            st.session_state[key] = new_hash
-            logging.info(f"✅ {label} updated successfully.")
-        except Exception as e:
-            st.error(f"❌ Failed to update {label}")
-            st.text(str(e))
-            traceback.print_exc()
+        pending_updates.append((ws, new_rows, label, new_hash, cells))
     else:
+        st.session_state.pop(f"{label}_dirty", None)
         logging.info(f"⏭️ {label} unchanged – skipping update.")
 
+@st.cache_resource(show_spinner=False)
+def get_save_executor():
+    """Ein Hintergrund-Thread pro Prozess: Sheet-Writes blockieren den Rerun nicht und bleiben in Reihenfolge."""
+    return ThreadPoolExecutor(max_workers=1)
+
+def stale_ranges(title, old_rows, new_rows):
+    """
+    A1-Bereiche mit alten Daten, die beim Schreiben von new_rows ab A1 nicht überschrieben werden.
+    Ist der Stand im Sheet unbekannt (old_rows=None), wird das ganze Sheet geleert.
+    """
+    if old_rows is None:
+        return [f"'{title}'"]
+
+    ranges = []
+    old_h, new_h = len(old_rows), len(new_rows)
+    old_w, new_w = max(map(len, old_rows), default=0), max(map(len, new_rows), default=0)
+    if old_h > new_h:
+        ranges.append(f"'{title}'!{new_h + 1}:{old_h}")
+    if old_w > new_w:
+        ranges.append(f"'{title}'!{rowcol_to_a1(1, new_w + 1)}:{rowcol_to_a1(max(old_h, 1), old_w)}")
+    return ranges
+
+def is_transient_api_error(e):
+    """Nur Rate-Limits (429) und Serverfehler (5xx) der Sheets-API lohnen einen erneuten Versuch."""
+    if not isinstance(e, gspread.exceptions.APIError):
+        return False
+    status = e.response.status_code
+    return status == 429 or status >= 500
+
+@retry(
+    wait=wait_exponential_jitter(multiplier=0.5, max=8),
+    stop=stop_after_attempt(5),
+    retry=retry_if_exception(is_transient_api_error),
+    reraise=True
+)
+def write_batch(spreadsheet, clear_ranges, data, labels):
+    """
+    Läuft im Hintergrund-Thread – daher keine Streamlit-Aufrufe, Fehler werden geworfen.
+    Leeren + Schreiben ist idempotent und wird bei 429/5xx als Ganzes mit Backoff wiederholt.
+    """
+    if clear_ranges:
+        spreadsheet.values_batch_clear(body={"ranges": clear_ranges})
+    spreadsheet.values_batch_update({"valueInputOption": "RAW", "data": data})
+    logging.info(f"✅ {labels} updated successfully.")
+
+def rollback_save(labels):
+    """Verwirft den gemerkten Stand der Abschnitte, damit sie beim nächsten Speichern komplett neu geschrieben werden."""
+    for label in labels:
+        st.session_state.pop(f"{label}_hash", None)
+        st.session_state.pop(f"{label}_rows", None)
+    mark_dirty(*labels)
+
+def check_previous_saves(supersede_pending):
+    """
+    Wertet frühere Hintergrund-Jobs aus und zeigt Fehler an.
+    supersede_pending=True (es wird gleich neu gespeichert): noch wartende Jobs werden durch den aktuellen Stand ersetzt.
+    """
+    running = []
+    for future, labels in st.session_state.get("_save_jobs", []):
+        if supersede_pending and future.cancel():
+            logging.info(f"⏭️ Pending save of {', '.join(labels)} superseded – merging into current save.")
+            rollback_save(labels)
+        elif not future.done():
+            running.append((future, labels))
+        elif future.exception() is not None:
+            e = future.exception()
+            logging.error(f"❌ Failed to update {', '.join(labels)}", exc_info=e)
+            st.error(f"❌ Failed to update {', '.join(labels)}")
+            st.text(str(e))
+            rollback_save(labels)
+    st.session_state["_save_jobs"] = running
+
+def sheet_state_unknown(label):
+    """
+    True, solange ein früherer Job für den Abschnitt noch läuft: der optimistisch gemerkte Stand ist dann nicht
+    gesichert und taugt nicht als Basis für Zell-Diffs oder gezieltes Leeren.
+    (Fehlgeschlagene Jobs hat check_previous_saves() vorher schon per rollback_save() zurückgesetzt.)
+    """
+    return any(label in labels and not future.done() for future, labels in st.session_state.get("_save_jobs", []))
+
+def flush_updates(spreadsheet, updates):
+    """
+    Schreibt alle vorgemerkten Sheets/Zellen im Hintergrund mit einem values_batch_update; ein batch_clear
+    nur, wenn ein Sheet schrumpft (oder sein Stand unbekannt ist). Der Stand wird optimistisch übernommen; check_previous_saves() setzt ihn bei Fehlern zurück.
+    """
+    if not updates:
+        return
+
+    labels = [label for (_, _, label, _, _) in updates]
+    data = []
+    for (ws, rows, _, _, cells) in updates:
+        if cells is None:
+            data.append({"range": f"'{ws.title}'!A1", "values": rows})
+        else:
+            data.extend({"range": f"'{ws.title}'!{a1}", "values": [[value]]} for a1, value in cells)
+    clear_ranges = [
+        a1
+        for (ws, rows, label, _, cells) in updates if cells is None
+        for a1 in stale_ranges(ws.title, None if sheet_state_unknown(label) else st.session_state.get(f"{label}_rows"), rows)
+    ]
+
+    future = get_save_executor().submit(write_batch, spreadsheet, clear_ranges, data, ", ".join(labels))
+    st.session_state.setdefault("_save_jobs", []).append((future, labels))
+
+    for (_, rows, label, new_hash, _) in updates:
+        st.session_state[f"{label}_hash"] = new_hash
+        st.session_state[f"{label}_rows"] = rows  # Stand im Sheet – Basis für Zell-Diffs
+        st.session_state.pop(f"{label}_dirty", None)
+
 # --- 📄 App Layout & Titel ---
 st.set_page_config(layout="wide")
 st.title("🏝️ Land Decision Matrix")
@@ -50,300 +181,471 @@ st.title("🏝️ Land Decision Matrix")
 # --- 🧠 Initialisierung von Session State ---
 if "criteria_list" not in st.session_state:
     st.session_state.criteria_list = []
+    # Erster Run der Session: einmal alles abgleichen, danach nur noch nach echten Änderungen
+    mark_dirty(*SHEET_LABELS)
 
 # --- Google Sheets Setup ---
 SHEET_NAME = "Decision Matrix Data"
 scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
 
-# 🔐 Secrets aus Streamlit einlesen (aus [google]-Block)
-creds_json = dict(st.secrets["google"])
-credentials = ServiceAccountCredentials.from_json_keyfile_dict(creds_json, scope)
-client = gspread.authorize(credentials)
+WORKSHEET_NAMES = ["options", "setup", "comments", "Overview", "Full Scores"]
 
-# --- 📄 Globaler Zugriff auf alle Worksheets (nur 1× öffnen, abgesichert) ---
-try:
+@st.cache_resource(show_spinner=False)
+def get_clients():
+    """
+    Baut Credentials, gspread-Client, Spreadsheet-/Worksheet-Handles und Drive-Service einmal pro Prozess.
+    Fehler werden von st.cache_resource nicht gecacht – der nächste Rerun versucht es erneut.
+    """
+    # 🔐 Secrets aus Streamlit einlesen (aus [google]-Block)
+    creds_json = dict(st.secrets["google"])
+    credentials = ServiceAccountCredentials.from_json_keyfile_dict(creds_json, scope)
+    client = gspread.authorize(credentials)
     spreadsheet = client.open(SHEET_NAME)
-    ws_options = spreadsheet.worksheet("options")
-    ws_setup = spreadsheet.worksheet("setup")
-    ws_comments = spreadsheet.worksheet("comments")
-    ws_overview = spreadsheet.worksheet("Overview")
-    ws_scores = spreadsheet.worksheet("Full Scores")
+    worksheets = {name: spreadsheet.worksheet(name) for name in WORKSHEET_NAMES}
+    drive_service = build("drive", "v3", credentials=credentials, cache_discovery=False)
+    return credentials, client, spreadsheet, worksheets, drive_service
+
+# --- 📄 Globaler Zugriff auf alle Worksheets (gecacht über Reruns, abgesichert) ---
+try:
+    credentials, client, spreadsheet, worksheets, drive_service = get_clients()
+    ws_options = worksheets["options"]
+    ws_setup = worksheets["setup"]
+    ws_comments = worksheets["comments"]
+    ws_overview = worksheets["Overview"]
+    ws_scores = worksheets["Full Scores"]
 except Exception as e:
     st.error(f"❌ Fehler beim Öffnen des Google Sheets: {e}")
     traceback.print_exc()
     st.stop()
 
 # --- Google Drive Setup ---
-FOLDER_ID = "1i6W2CHXgnIn9g51tgs1WgAdZM_lK1HKP"
-drive_service = build("drive", "v3", credentials=credentials)
-
-def upload_to_drive(file, opt_key):
-    tmp_file = None
-    tmp_path = None
-    max_retries = 5
-    initial_delay = 0.1
+_drive_http = threading.local()
 
-    try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{uuid.uuid4()}_{file.name}", mode="wb") as tmp_file:
-            tmp_file.write(file.getbuffer())
-            tmp_file.flush()
-            tmp_path = tmp_file.name  # wichtig: Name sichern
+def drive_http():
+    """
+    Eigene autorisierte HTTP-Verbindung pro Thread für Drive-Calls: drive_service wird prozessweit geteilt,
+    sein httplib2.Http ist aber nicht thread-safe (jede Streamlit-Session läuft in eigenen Threads).
+    build_http() setzt wie beim Service selbst einen Socket-Timeout (60 s), damit ein hängender Call scheitert statt blockiert.
+    """
+    if not hasattr(_drive_http, "http"):
+        _drive_http.http = credentials.authorize(build_http())
+    return _drive_http.http
 
-        file_metadata = {"name": file.name, "parents": [FOLDER_ID]}
-        media = MediaFileUpload(tmp_path, resumable=False)
-        uploaded = drive_service.files().create(body=file_metadata, media_body=media, fields="id").execute()
+FOLDER_ID = "1i6W2CHXgnIn9g51tgs1WgAdZM_lK1HKP"
+MAX_UPLOAD_WORKERS = 4
+RESUMABLE_UPLOAD_THRESHOLD = 5 * 1024 * 1024  # darunter ist Multipart schneller
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
 
-        drive_service.permissions().create(fileId=uploaded["id"], body={"role": "reader", "type": "anyone"}).execute()
-        return f"https://drive.google.com/uc?id={uploaded['id']}"
+def upload_to_drive(file, opt_key):
+    """
+    Lädt eine Datei nach Drive hoch und gibt ihre Datei-ID zurück (Freigabe erfolgt gebündelt in share_files_publicly).
+    Thread-sicher: keine Streamlit-Aufrufe, eigene HTTP-Verbindung pro Thread. Fehler werden geworfen.
+    """
+    # UploadedFile ist bereits ein BytesIO im Speicher → direkt streamen, kein Temp-File und keine Kopie
+    file.seek(0)
+    file_metadata = {"name": file.name, "parents": [FOLDER_ID]}
+    # Kleine Bilder als Multipart (1 Request), nur große Dateien resumable in Chunks
+    media = MediaIoBaseUpload(
+        file,
+        mimetype=file.type or "application/octet-stream",
+        chunksize=UPLOAD_CHUNK_SIZE,
+        resumable=file.size > RESUMABLE_UPLOAD_THRESHOLD,
+    )
+    uploaded = drive_service.files().create(body=file_metadata, media_body=media, fields="id").execute(http=drive_http())
+    return uploaded["id"]
 
-    except Exception as e:
-        logging.error("❌ Upload to Google Drive failed", exc_info=True)
-        st.error(f"❌ Upload failed for '{file.name}': {e}")
-        return None
-
-    finally:
-        if tmp_path and os.path.exists(tmp_path):
-            for attempt in range(max_retries):
-                try:
-                    os.remove(tmp_path)
-                    break
-                except OSError as oe:
-                    delay = initial_delay * (2 ** attempt)
-                    logging.warning(f"⚠️ Attempt {attempt+1}: Failed to delete temp file '{tmp_path}': {oe}")
-                    time.sleep(delay)
-
-# --- Setup-Daten laden ---
-@st.cache_data(ttl=600, show_spinner=False)
-def load_setup_data(_ws_setup):
-    try:
-        return pd.DataFrame(_ws_setup.get_all_records())
-    except Exception as e:
-        st.warning("⚠️ Fehler beim Laden der Setup-Daten.")
-        st.text(str(e))
-        return pd.DataFrame()
-    
-@st.cache_data(ttl=600, show_spinner=False)
-def load_options_data(_ws_options):
+def share_files_publicly(file_ids):
+    """
+    Gibt alle Dateien mit einem einzigen Batch-Request öffentlich lesbar frei.
+    (Uploads selbst lassen sich in der Drive-API nicht batchen, die Freigaben schon.)
+    Gibt {file_id: Exception} für fehlgeschlagene Freigaben zurück.
+    """
+    errors = {}
+    if not file_ids:
+        return errors
+
+    def on_done(request_id, response, exception):
+        if exception is not None:
+            errors[request_id] = exception
+
+    batch = drive_service.new_batch_http_request(callback=on_done)
+    for file_id in file_ids:
+        batch.add(drive_service.permissions().create(fileId=file_id, body={"role": "reader", "type": "anyone"}), request_id=file_id)
+    batch.execute(http=drive_http())
+    return errors
+
+def delete_drive_file(file_id):
+    """Entfernt eine (z.B. nicht freigegebene) Datei wieder aus Drive, damit bei erneutem Upload keine Waisen entstehen."""
+    drive_service.files().delete(fileId=file_id).execute(http=drive_http())
+
+def make_thumbnail(file_bytes, max_size):
+    """Verkleinert ein Bild auf max. max_size×max_size Pixel und gibt es als kompaktes JPEG zurück."""
+    from PIL import Image  # Lazy Import: nur nötig, wenn Bilder angezeigt werden
+
+    img = Image.open(io.BytesIO(file_bytes))
+    img.thumbnail((max_size, max_size))
+    out = io.BytesIO()
+    img.convert("RGB").save(out, "JPEG", quality=70)
+    return out.getvalue()
+
+@st.cache_data(max_entries=128, show_spinner=False)
+def load_drive_thumbnail(file_id, max_size):
+    """Lädt ein bestehendes Drive-Bild einmalig herunter und gibt es als Thumbnail zurück (gecacht nach Datei-ID)."""
+    return make_thumbnail(drive_service.files().get_media(fileId=file_id).execute(http=drive_http()), max_size)
+
+# --- Setup-Daten laden (Cache-Schlüssel = Revision des Spreadsheets statt fester TTL) ---
+def get_sheet_revision():
+    """
+    Liefert die letzte Änderungszeit des Spreadsheets laut Drive (ein leichter Metadaten-Call).
+    Schlägt das fehl, dient ein 10-Minuten-Zeitfenster als Ersatz – wie die frühere TTL.
+    """
     try:
-        return pd.DataFrame(_ws_options.get_all_records())
+        return drive_service.files().get(fileId=spreadsheet.id, fields="modifiedTime").execute(http=drive_http())["modifiedTime"]
     except Exception as e:
-        st.warning("⚠️ Fehler beim Laden der Options-Daten.")
-        st.text(str(e))
-        return pd.DataFrame()
+        logging.warning(f"⚠️ Could not read sheet revision, falling back to time window: {e}")
+        return f"window-{int(time.time() // 600)}"
 
-@st.cache_data(ttl=600, show_spinner=False)
-def load_comment_data(_ws_comments):
-    try:
-        return _ws_comments.get_all_values()
-    except Exception as e:
-        st.warning("⚠️ Fehler beim Laden der Kommentare.")
-        st.text(str(e))
-        return []
+LOAD_SHEETS = ["setup", "options", "comments"]
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def load_sheet_data(_spreadsheet, revision):
+    """
+    Liest setup, options und comments mit einem einzigen values_batch_get und gibt {Sheet-Name: Zeilen} zurück.
+    Zeilen werden rechteckig aufgefüllt (die API lässt leere Zellen am Zeilenende weg).
+    Fehler nicht abfangen: st.cache_data cacht nur erfolgreiche Ergebnisse, der Aufrufer zeigt die Warnung.
+    """
+    res = _spreadsheet.values_batch_get(ranges=LOAD_SHEETS, params={"valueRenderOption": "UNFORMATTED_VALUE"})
+    data = {}
+    for name, value_range in zip(LOAD_SHEETS, res["valueRanges"]):
+        values = value_range.get("values", [])
+        data[name] = fill_gaps(values) if values else []
+    return data
+
+# --- 🔄 Manuelles Neuladen: gecachte Sheet-Daten verwerfen ---
+if st.button("🔄 Reload from Sheets"):
+    load_sheet_data.clear()
+    st.session_state.pop("_options_revision", None)
 
 # --- Initial Load from Sheets ---
+sheet_revision = get_sheet_revision()
+
 try:
-    setup_data = load_setup_data(ws_setup)
-    if "Criteria" in setup_data.columns and "Weight" in setup_data.columns:
-        st.session_state.criteria_list = setup_data["Criteria"].tolist()
-        for i, row in setup_data.iterrows():
-            st.session_state[f"weight_{row['Criteria']}"] = float(row["Weight"])
+    sheet_data = load_sheet_data(spreadsheet, sheet_revision)
 except Exception as e:
-    st.warning(f"Could not load setup data from Google Sheets: {e}")
+    st.warning(f"Could not load data from Google Sheets: {e}")
+    sheet_data = {}
 
 try:
-    opt_data = load_options_data(ws_options)
-    option_labels = dict(zip(opt_data["Key"], opt_data["Label"]))
-    existing_urls = dict(zip(opt_data["Key"], opt_data.get("Image URLs", [""] * len(opt_data))))
-    options = list(option_labels.keys())
-    options.sort()
+    setup_rows = sheet_data.get("setup", [])
+    if setup_rows and "Criteria" in setup_rows[0] and "Weight" in setup_rows[0]:
+        ci, wi = setup_rows[0].index("Criteria"), setup_rows[0].index("Weight")
+        st.session_state.criteria_list = [r[ci] for r in setup_rows[1:]]
+        for r in setup_rows[1:]:
+            st.session_state[f"weight_{r[ci]}"] = float(r[wi])
 except Exception as e:
-    st.warning(f"Could not load options data from Google Sheets: {e}")
-    option_labels = {}
-    existing_urls = {}
-    options = []
+    st.warning(f"Could not load setup data from Google Sheets: {e}")
+
+# Options-Dicts leben in der Session und werden nur neu aufgebaut, wenn sich das Sheet geändert hat
+if st.session_state.get("_options_revision") != sheet_revision:
+    try:
+        opt_rows = sheet_data.get("options", [])
+        header = opt_rows[0] if opt_rows else []
+        ki, li = header.index("Key"), header.index("Label")
+        ui = header.index("Image URLs") if "Image URLs" in header else None
+        st.session_state.option_labels = {r[ki]: r[li] for r in opt_rows[1:]}
+        st.session_state.existing_urls = {r[ki]: (r[ui] if ui is not None else "") for r in opt_rows[1:]}
+        st.session_state._options_revision = sheet_revision
+    except Exception as e:
+        st.warning(f"Could not load options data from Google Sheets: {e}")
+
+option_labels = st.session_state.setdefault("option_labels", {})
+existing_urls = st.session_state.setdefault("existing_urls", {})
+options = sorted(option_labels)
 
 # --- Dynamische Optionenzahl ---
-col_count = st.number_input("How many land options?", min_value=1, max_value=10, value=len(options) or 3, step=1)
+col_count = st.number_input(
+    "How many land options?", min_value=1, max_value=10, value=len(options) or 3, step=1,
+    on_change=mark_dirty, args=SHEET_LABELS
+)
 for i in range(col_count):
     key = f"Option {chr(65+i)}"
     if key not in option_labels:
         option_labels[key] = key
-    label = st.text_input(f"Label for {key}", value=option_labels[key], key=f"label_{key}")
+    label = st.text_input(
+        f"Label for {key}", value=option_labels[key], key=f"label_{key}",
+        on_change=mark_dirty, args=("Options", "Comments", "Overview", "Full Scores")
+    )
     option_labels[key] = label
 options = list(option_labels.keys())
 options.sort()
 
 # --- Add new criterion ---
-new_criterion = st.text_input("➕ Add new criterion", "")
+new_criterion = st.text_input(
+    "➕ Add new criterion", "", on_change=mark_dirty, args=("Criteria", "Comments", "Overview", "Full Scores")
+)
 if new_criterion and new_criterion not in st.session_state.criteria_list:
     st.session_state.criteria_list.append(new_criterion)
 
 persons = ["Maya", "Mike"]
 total_scores = {}
-all_scores = []
+total_placeholders = {}
 image_urls = {}
 
 try:
-    comment_data = load_comment_data(ws_comments)
+    comment_data = sheet_data.get("comments", [])
     if comment_data:
+        label_to_key = {label: opt_key for opt_key, label in option_labels.items()}
         for row in comment_data[1:]:
             crit, opt_label, comment = row
-            for opt_key, label in option_labels.items():
-                if label == opt_label:
-                    st.session_state[f"comment_{crit}_{opt_key}"] = comment
+            opt_key = label_to_key.get(opt_label)
+            if opt_key:
+                st.session_state[f"comment_{crit}_{opt_key}"] = comment
 except Exception as e:
     st.warning(f"Could not load comments from Google Sheets: {e}")
 
-# --- Global Criteria Weighting ---
-st.markdown("### ⚖️ Global Criteria Weighting")
-
-for crit in st.session_state.criteria_list:
-    st.session_state[f"weight_{crit}"] = st.number_input(
-        f"Weight for '{crit}'",
-        min_value=0.0,
-        max_value=5.0,
-        step=0.1,
-        value=st.session_state.get(f"weight_{crit}", 1.0),
-        key=f"weight_input_{crit}"
+# --- 📝 Bewertungsformular: Gewichte, Bilder & Bewertungstabellen lösen erst beim Absenden einen Rerun aus ---
+with st.form("evaluation_form"):
+    # --- Global Criteria Weighting ---
+    st.markdown("### ⚖️ Global Criteria Weighting")
+
+    # Ein Tabellen-Widget für alle Gewichte statt je einem number_input pro Kriterium
+    weights_df = pd.DataFrame({
+        "Criteria": st.session_state.criteria_list,
+        "Weight": [st.session_state.get(f"weight_{crit}", 1.0) for crit in st.session_state.criteria_list],
+    })
+    edited_weights = st.data_editor(
+        weights_df,
+        num_rows="fixed",
+        hide_index=True,
+        disabled=["Criteria"],
+        column_config={"Weight": st.column_config.NumberColumn(min_value=0.0, max_value=5.0, step=0.1, required=True, default=1.0)},
+        use_container_width=True,
+        key="weights_editor"
     )
-
-# --- Input UI ---
-st.subheader("📋 Evaluation per Land Option")
-
-for opt in options:
-    label = option_labels[opt]
-    with st.container():
-        st.markdown(f"### 🏝️ {label}")  # Option A+B+C+D etc.
-
-        # --- Moved Image Upload Section ---
-        st.markdown("**🖼 Upload Images**")
-
-        # Feste Bildmaße für alle iFrames (zentral definieren)
-        image_iframe_height = 170
-        image_width_opt = 200
-        n_cols = 3  # Anzahl der Bildspalten in der Anzeige
-
-        # Bestehende Bild-URLs holen
-        existing_links = existing_urls.get(opt, "").split(", ") if existing_urls.get(opt) else []
-
-        # Upload-Widget
-        uploaded = st.file_uploader(
-            f"Upload image(s) for {label}",
-            type=["jpg", "jpeg", "png"],
-            accept_multiple_files=True,
-            key=f"img_{opt}"
-        )
-
-        # Alle Bild-URLs sammeln (bestehend + neu)
-        urls = existing_links.copy()
-
-        # Alle neuen Bilder einmalig hochladen und Links sammeln
-        if uploaded:
-            for file in uploaded:
-                # Prüfen, ob Datei (nach Name) schon in einem vorhandenen Link enthalten ist
-                if not any(file.name in link for link in urls):
+    # Geleerte Zellen zählen als Standardgewicht 1.0 – NaN würde alle Summen und den Sheets-Save kaputt machen
+    for crit, weight in zip(edited_weights["Criteria"], edited_weights["Weight"].fillna(1.0)):
+        st.session_state[f"weight_{crit}"] = float(weight)
+
+    # --- Input UI ---
+    st.subheader("📋 Evaluation per Land Option")
+
+    # Alle Bewertungen in einem zusammenhängenden int8-Array: scores[Option, Person, Kriterium]
+    crit_list = st.session_state.criteria_list
+    scores = np.empty((len(options), len(persons), len(crit_list)), dtype=np.int8)
+
+    for oi, opt in enumerate(options):
+        label = option_labels[opt]
+        with st.container():
+            st.markdown(f"### 🏝️ {label}")  # Option A+B+C+D etc.
+
+            # --- Moved Image Upload Section ---
+            st.markdown("**🖼 Upload Images**")
+
+            # Feste Bildbreite für alle Vorschaubilder (zentral definieren)
+            image_width_opt = 200
+            n_cols = 3  # Anzahl der Bildspalten in der Anzeige
+
+            # Bestehende Bild-URLs holen
+            existing_links = existing_urls.get(opt, "").split(", ") if existing_urls.get(opt) else []
+
+            # Upload-Widget
+            uploaded = st.file_uploader(
+                f"Upload image(s) for {label}",
+                type=["jpg", "jpeg", "png"],
+                accept_multiple_files=True,
+                key=f"img_{opt}"
+            )
+
+            # In dieser Session bereits hochgeladene Dateien (Upload-ID → Link) – Drive-Links enthalten keinen Dateinamen
+            uploaded_files = st.session_state.setdefault(f"uploaded_files_{opt}", {})
+
+            # Alle Bild-URLs sammeln (bestehend + neu)
+            urls = existing_links + [link for link in uploaded_files.values() if link not in existing_links]
+
+            # Lokale Thumbnails bereits hochgeladener Bilder (Link → JPEG-Bytes), überdauern Reruns
+            thumbnails = st.session_state.setdefault(f"thumbnails_{opt}", {})
+
+            # Alle neuen Bilder einmalig hochladen und Links sammeln
+            if uploaded:
+                new_files = []
+                for file in uploaded:
+                    # Prüfen, ob genau diese Auswahl schon hochgeladen wurde – file_id ist pro Upload eindeutig,
+                    # gleichnamige aber verschiedene Dateien werden so nicht fälschlich übersprungen
+                    if file.file_id not in uploaded_files:
+                        new_files.append(file)
+                    else:
+                        logging.info(f"⏭️ Upload skipped – file '{file.name}' already uploaded.")
+
+                # Uploads sind I/O-gebunden → parallel im Thread-Pool, Ergebnisse in Upload-Reihenfolge
+                if new_files:
+                    with ThreadPoolExecutor(max_workers=min(MAX_UPLOAD_WORKERS, len(new_files))) as executor:
+                        futures = [(file, executor.submit(upload_to_drive, file, opt)) for file in new_files]
+                    created = []
+                    for file, future in futures:
+                        try:
+                            created.append((file, future.result()))
+                        except Exception as e:
+                            logging.error(f"❌ Upload to Google Drive failed for '{file.name}'", exc_info=e)
+                            st.error(f"❌ Upload failed for '{file.name}': {e}")
+
+                    # Freigaben aller neuen Dateien in einem Batch-Request statt je einem Call pro Datei
                     try:
-                        link = upload_to_drive(file, opt)
-                        if link:
-                            urls.append(link)
+                        share_errors = share_files_publicly([file_id for _, file_id in created])
                     except Exception as e:
-                        st.warning(f"❌ An unexpected error occurred during image processing: {e}")
-                else:
-                    logging.info(f"⏭️ Upload skipped – file '{file.name}' already exists in links.")
-
-        for idx, url in enumerate(urls):
-            with cols[idx % n_cols]:
-                if "drive.google.com" in url and "id=" in url:
-                    file_id = url.split("id=")[-1].strip()
-                    embed_url = f"https://drive.google.com/file/d/{file_id}/preview"
-                    st.components.v1.iframe(
-                        embed_url,
-                        height=image_iframe_height,
-                        width=image_width_opt,
-                        key=f"img_iframe_{opt}_{idx}"  # <--- Hier der neue Key
-                    )
-                else:
-                    st.warning("⚠️ Invalid image URL.")
-
-        # Aktualisierte URLs zurück speichern
-        image_urls[opt] = ", ".join(sorted(list(set(urls))))
-
-        # --- Weiter mit dem Bewertungsblock oder anderem Content ---
-        st.markdown("**📝 Evaluation**")
-        df_rows = []
+                        share_errors = {file_id: e for _, file_id in created}
+
+                    for file, file_id in created:
+                        if file_id in share_errors:
+                            logging.error(f"❌ Sharing Drive file failed for '{file.name}'", exc_info=share_errors[file_id])
+                            st.error(f"❌ Upload failed for '{file.name}': {share_errors[file_id]}")
+                            # Nicht freigegebene Datei nicht liegen lassen – der nächste Submit lädt sie ohnehin neu hoch
+                            try:
+                                delete_drive_file(file_id)
+                            except Exception as e:
+                                logging.warning(f"⚠️ Could not delete unshared Drive file '{file_id}': {e}")
+                            continue
+                        link = f"https://drive.google.com/uc?id={file_id}"
+                        urls.append(link)
+                        uploaded_files[file.file_id] = link
+                        mark_dirty("Options")
+                        # Vorschau einmalig lokal verkleinern statt bei jedem Rerun das Original zu laden
+                        try:
+                            thumbnails[link] = make_thumbnail(file.getvalue(), image_width_opt)
+                        except Exception as e:
+                            # z.B. defekte/falsch benannte Datei oder DecompressionBombError – Anzeige fällt auf die Drive-Vorschau zurück
+                            logging.warning(f"⚠️ Could not create local preview for '{file.name}': {e}")
+
+            img_cols = st.columns(n_cols)
+            for idx, url in enumerate(urls):
+                with img_cols[idx % n_cols]:
+                    if url in thumbnails:
+                        st.image(thumbnails[url], width=image_width_opt)
+                    elif "drive.google.com" in url and "id=" in url:
+                        file_id = url.split("id=")[-1].strip()
+                        try:
+                            st.image(load_drive_thumbnail(file_id, image_width_opt), width=image_width_opt)
+                        except Exception as e:
+                            logging.warning(f"⚠️ Could not load preview for Drive file '{file_id}': {e}")
+                            st.warning("⚠️ Could not load image preview.")
+                    else:
+                        st.warning("⚠️ Invalid image URL.")
+
+            # Aktualisierte URLs zurück speichern – Reihenfolge beibehalten, Duplikate in einem Durchlauf entfernen
+            image_urls[opt] = ", ".join(dict.fromkeys(urls))
+
+            # --- Weiter mit dem Bewertungsblock oder anderem Content ---
+            st.markdown("**📝 Evaluation**")
+            # Ein Tabellen-Widget pro Option (Kriterien × Personen) statt je einem Slider pro Zelle
+            eval_df = pd.DataFrame(
+                {person: [st.session_state.get(f"score_{person}_{opt}_{crit}", 3) for crit in crit_list] for person in persons},
+                index=pd.Index(crit_list, name="Criteria"),
+            )
+            edited_eval = st.data_editor(
+                eval_df,
+                num_rows="fixed",
+                column_config={
+                    person: st.column_config.NumberColumn(min_value=1, max_value=5, step=1, format="%d")
+                    for person in persons
+                },
+                use_container_width=True,
+                key=f"eval_{opt}"
+            )
+            # Geleerte Zellen zählen wieder als neutrale 3
+            scores[oi] = edited_eval[persons].fillna(3).clip(1, 5).to_numpy(dtype=np.int8).T  # [Person, Kriterium]
+            for pi, person in enumerate(persons):
+                for ci, crit in enumerate(crit_list):
+                    st.session_state[f"score_{person}_{opt}_{crit}"] = int(scores[oi, pi, ci])
+
+            # Platzhalter – Gesamtscore wird nach der Schleife für alle Optionen auf einmal berechnet
+            total_placeholders[opt] = st.empty()
+
+    st.form_submit_button("💾 Save", on_click=submit_evaluation, type="primary")
+
+# --- 🧮 Gesamtscores (vektorisiert: Scores[Option, Person, Kriterium] @ Gewichte) ---
+weights = np.array([st.session_state.get(f"weight_{c}", 1.0) for c in crit_list], dtype=np.float32)
+avg_scores = scores.mean(axis=1, dtype=np.float32)  # [Option, Kriterium] – Mittelwert über Personen
+totals = avg_scores @ weights
+
+for i, opt in enumerate(options):
+    label = option_labels[opt]
+    total_scores[label] = float(totals[i])
+    total_placeholders[opt].success(f"✅ Total Score for {label}: {round(total_scores[label], 2)}")
+
+# --- Smart Save Block: nur auf Knopfdruck, nur geänderte Abschnitte (Dirty-Flags), Hash Check & Batch Write ---
+def force_sync_full_scores():
+    """Diff-Basis verwerfen → das komplette Full-Scores-Sheet wird neu geschrieben."""
+    st.session_state.pop("Full Scores_rows", None)
+    st.session_state.pop("Full Scores_hash", None)
+    mark_dirty("Full Scores")
+    request_save()
+
+# Ergebnisse früherer Hintergrund-Saves auch ohne neuen Save auswerten (Fehler sofort anzeigen)
+save_requested = st.session_state.pop("_save_requested", False)
+check_previous_saves(supersede_pending=save_requested)
+
+st.button("🔁 Force sync Full Scores", on_click=force_sync_full_scores)
+
+# Änderungen sammeln sich über Dirty-Flags, bis gespeichert wird – Reruns durch Eingaben kosten keine Sheets-Arbeit
+if save_requested:
+    # Optionen
+    if is_dirty("Options"):
+        rows_options = [["Key", "Label", "Image URLs"]] + [[k, v, image_urls.get(k, "")] for k, v in option_labels.items()]
+        safe_update(ws_options, rows_options, "Options")
+
+    # Kriterien
+    if is_dirty("Criteria"):
+        rows_criteria = [["Criteria", "Weight"]] + [[crit, st.session_state.get(f"weight_{crit}", 1.0)] for crit in st.session_state.criteria_list]
+        safe_update(ws_setup, rows_criteria, "Criteria")
+
+    # Kommentare
+    if is_dirty("Comments"):
+        rows_comments = [["Criteria", "Option", "Comment"]]
         for crit in st.session_state.criteria_list:
-            row = {"Criteria": crit}
-            cols = st.columns([2, 2, 2])
-            with cols[0]:
-                st.markdown(f"**{crit}**")
-            for i, person in enumerate(persons):
-                slider_key = f"{person}_{opt}_{crit}"
-                slider_val = st.session_state.get(slider_key, 3)
-                with cols[i + 1]:
-                    slider_val = st.slider(f"{person}", 1, 5, slider_val, key=slider_key)
-                row[person] = slider_val
-                all_scores.append((crit, person, opt, slider_val))
-            df_rows.append(row)
-
-        df = pd.DataFrame(df_rows)
-        if "Criteria" in df.columns:
-            available_persons = [p for p in persons if p in df.columns]
-            if available_persons:
-                df["Average"] = df[available_persons].mean(axis=1)
-            else:
-                df["Average"] = 3
-            df["Weight"] = df["Criteria"].map(lambda c: st.session_state.get(f"weight_{c}", 1.0))
-            df["Weighted"] = df["Average"] * df["Weight"]
-            total_scores[label] = df["Weighted"].sum()
+            for opt in options:
+                comment = st.session_state.get(f"comment_{crit}_{opt}", "")
+                if comment:
+                    rows_comments.append([crit, option_labels[opt], comment])
+        if len(rows_comments) > 1:
+            safe_update(ws_comments, rows_comments, "Comments")
+        else:
+            st.session_state.pop("Comments_dirty", None)
+            logging.info("⏭️ No comments to save.")
+
+    # Übersicht
+    if is_dirty("Overview"):
+        header_overview = ["Criteria"] + list(option_labels.values())
+        overview = np.round(avg_scores.T.astype(np.float64), 2)  # [Kriterium, Option]
+        rows_overview = [[crit] + overview[ci].tolist() for ci, crit in enumerate(crit_list)]
+        if rows_overview:
+            safe_update(ws_overview, [header_overview] + rows_overview, "Overview")
+        else:
+            st.session_state.pop("Overview_dirty", None)
+
+    # Einzelbewertungen
+    if is_dirty("Full Scores"):
+        score_list = scores.tolist()  # eine Konvertierung nach Python-ints für die Sheet-Zeilen
+        opt_labels = [option_labels.get(opt, opt) for opt in options]  # Label-Lookup einmal pro Option
+        rows_scores = [["Criteria", "Person", "Option", "Score"]] + [
+            [crit, person, opt_labels[oi], score_list[oi][pi][ci]]
+            for oi in range(len(options))
+            for ci, crit in enumerate(crit_list)
+            for pi, person in enumerate(persons)
+        ]
+        # Läuft noch ein früherer Save, ist der Sheet-Stand unbekannt → komplett neu schreiben statt Zell-Diff
+        last_rows = None if sheet_state_unknown("Full Scores") else st.session_state.get("Full Scores_rows")
+        if len(rows_scores) > 1 and last_rows and len(last_rows) == len(rows_scores) \
+                and all(old[:3] == new[:3] for old, new in zip(last_rows, rows_scores)):
+            # Gleiche Zeilenstruktur → nur geänderte Score-Zellen (Spalte D) schreiben
+            cells = [(f"D{i + 1}", new[3]) for i, (old, new) in enumerate(zip(last_rows, rows_scores)) if old[3] != new[3]]
+            safe_update(ws_scores, rows_scores, "Full Scores", cells=cells)
+        elif len(rows_scores) > 1:
+            safe_update(ws_scores, rows_scores, "Full Scores")
         else:
-            df = pd.DataFrame()
-            total_scores[label] = 0
-
-        st.success(f"✅ Total Score for {label}: {round(total_scores[label], 2)}")
-
-# --- Smart Save Block with Hash Check (no Google Sheets read) ---
-# Optionen
-rows_options = [["Key", "Label", "Image URLs"]] + [[k, v, image_urls.get(k, "")] for k, v in option_labels.items()]
-safe_update(ws_options, rows_options, "Options")
-
-# Kriterien
-rows_criteria = [["Criteria", "Weight"]] + [[crit, st.session_state.get(f"weight_{crit}", 1.0)] for crit in st.session_state.criteria_list]
-safe_update(ws_setup, rows_criteria, "Criteria")
-
-# Kommentare
-rows_comments = [["Criteria", "Option", "Comment"]]
-for crit in st.session_state.criteria_list:
-    for opt in options:
-        comment = st.session_state.get(f"comment_{crit}_{opt}", "")
-        if comment:
-            rows_comments.append([crit, option_labels[opt], comment])
-if len(rows_comments) > 1:
-    safe_update(ws_comments, rows_comments, "Comments")
-else:
-    logging.info("⏭️ No comments to save.")
-
-# Übersicht
-header_overview = ["Criteria"] + list(option_labels.values())
-rows_overview = []
-for crit in st.session_state.criteria_list:
-    row = [crit]
-    for opt in options:
-        values = [val for (c, p, o, val) in all_scores if c == crit and o == opt]
-        avg = round(np.mean(values), 2) if values else ""
-        row.append(avg)
-    rows_overview.append(row)
-if rows_overview:
-    safe_update(ws_overview, [header_overview] + rows_overview, "Overview")
-
-# Einzelbewertungen
-rows_scores = [["Criteria", "Person", "Option", "Score"]] + [
-    [crit, person, option_labels.get(opt, opt), score]
-    for (crit, person, opt, score) in all_scores
-]
-if len(rows_scores) > 1:
-    safe_update(ws_scores, rows_scores, "Full Scores")
-else:
-    logging.info("⏭️ No full scores to save.")
+            st.session_state.pop("Full Scores_dirty", None)
+            logging.info("⏭️ No full scores to save.")
+
+    # Ein Round-Trip für alle geänderten Sheets, im Hintergrund statt im Render-Pfad
+    flush_updates(spreadsheet, pending_updates)
 
 # --- Overview Display ---
 st.subheader("📊 Comparison of All Land Options")
@@ -352,28 +654,35 @@ result_df = result_df.sort_values("Total Score", ascending=False).reset_index(dr
 st.dataframe(result_df, use_container_width=True)
 
 # --- PDF Export ---
-class PDF(FPDF):
-    def header(self):
-        self.set_font("Arial", "B", 14)
-        self.cell(0, 10, "Decision Matrix Summary", ln=True, align="C")
-        self.ln(5)
-
-    def table(self, data):
-        self.set_font("Arial", "B", 12)
-        self.cell(140, 10, "Option", 1)
-        self.cell(40, 10, "Total Score", 1)
-        self.ln()
-        self.set_font("Arial", "", 12)
-        for index, row in data.iterrows():
-            self.cell(140, 10, str(row["Option"]), 1)
-            self.cell(40, 10, str(round(row["Total Score"], 2)), 1)
-            self.ln()
-
+def draw_pdf_header(canvas, doc):
+    """Seitenkopf (auf jeder Seite) – entspricht dem früheren FPDF.header()."""
+    canvas.saveState()
+    canvas.setFont("Helvetica-Bold", 14)
+    canvas.drawCentredString(doc.pagesize[0] / 2, doc.pagesize[1] - 15 * mm, "Decision Matrix Summary")
+    canvas.restoreState()
+
+@st.cache_data(max_entries=8, show_spinner=False)
 def generate_pdf(df):
-    pdf = PDF()
-    pdf.add_page()
-    pdf.table(df)
-    return pdf.output(dest="S").encode("latin-1", errors="ignore")
+    """
+    Baut die Zusammenfassung als eine reportlab-Tabelle (ein Layout-Durchlauf statt Zelle-für-Zelle).
+    Gecacht nach Tabelleninhalt: Reruns ohne geänderte Scores bauen das PDF nicht neu.
+    """
+    data = [["Option", "Total Score"]] + [
+        [str(opt), str(round(score, 2))]
+        for opt, score in df[["Option", "Total Score"]].itertuples(index=False, name=None)
+    ]
+    table = Table(data, colWidths=[140 * mm, 40 * mm], repeatRows=1, hAlign="LEFT")
+    table.setStyle(TableStyle([
+        ("GRID", (0, 0), (-1, -1), 0.5, colors.black),
+        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+        ("FONTNAME", (0, 1), (-1, -1), "Helvetica"),
+        ("FONTSIZE", (0, 0), (-1, -1), 12),
+    ]))
+
+    buf = io.BytesIO()
+    doc = SimpleDocTemplate(buf, pagesize=A4, topMargin=25 * mm)
+    doc.build([table], onFirstPage=draw_pdf_header, onLaterPages=draw_pdf_header)
+    return buf.getvalue()
 
 if not result_df.empty:
     pdf_bytes = generate_pdf(result_df)